@@ -5,34 +5,245 @@ cinema_driver.py
 
 本模块用于 Raspberry Pi 4 上的摄像头采集，并针对机器人竞赛需求进行了全面扩展：
   - 支持摄像头初始化及动态参数设置（分辨率、帧率、曝光、白平衡、亮度等）
-  - 实现连续图像采集，采用独立线程运行，并支持回调机制联动后续模块
-  - 异常检测与自动重启，保证长时间运行的稳定性
+  - 实现连续图像采集，采集与处理分属两个线程，通过单槽“最新帧优先”缓冲衔接，
+    下游处理耗时不会拖慢摄像头，也不会累积过期帧；支持回调机制联动后续模块，
+    回调可按单帧或按批（如供神经网络批量推理）接收图像
+  - 可限制 OpenCV 内部线程数，并将采集线程、处理线程绑定到不同 CPU 核心，
+    避免预处理负载高峰时采集线程被抢占而丢帧
+  - 支持请求 YUYV 原始格式，直接取 Y 平面作为灰度图，省去两次颜色空间转换
+  - 可选 picamera2/libcamera 后端（CSI 摄像头），直接映射 DMA-BUF 帧缓冲区取数据，
+    省去 V4L2 读取时整帧拷贝到用户空间的开销
+  - 异常检测与自动重启，保证长时间运行的稳定性；回调出错时限频记录日志，
+    连续出错过多则自动注销，避免日志风暴拖慢处理线程
   - 调试模式支持实时显示采集图像，便于现场调试
 
 注意：部分高级参数的设置依赖于摄像头硬件和驱动支持情况，请根据实际硬件进行调整。
 """
 
 import cv2
+import os
 import time
 import threading
 import logging
+from collections import deque
+
+import numpy as np
+
+from image_preprocessing import PreprocBuffers
+
+# picamera2 为可选依赖（仅 Raspberry Pi OS 提供），未安装时只能使用 OpenCV 后端
+try:
+    from picamera2 import MappedArray, Picamera2
+    PICAMERA2_AVAILABLE = True
+except ImportError:
+    MappedArray = Picamera2 = None
+    PICAMERA2_AVAILABLE = False
 
 # 配置日志输出
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
 
+# 支持的采集像素格式：'BGR'（驱动默认，OpenCV 转为 BGR）、
+# 'YUYV'（保留原始 YUYV，连续采集时回调收到 Y 平面灰度图）、'MJPG'（USB 摄像头带宽更低，解码为 BGR）
+PIXEL_FORMATS = ('BGR', 'YUYV', 'MJPG')
+
+# 采集后端：'opencv'（cv2.VideoCapture / V4L2，适用于 USB 摄像头）、
+# 'picamera2'（libcamera，适用于 CSI 摄像头，输出固定为 YUV420，不支持 'MJPG'）
+BACKENDS = ('opencv', 'picamera2')
+
+class _Picamera2Capture:
+    """
+    picamera2 采集适配器，提供与 cv2.VideoCapture 相同的 isOpened/read/set/get/release 接口，
+    驱动其余部分无需区分后端。
+    
+    输出流配置为 YUV420（I420）格式。每帧通过 capture_request() 取得，以 MappedArray 直接映射
+    DMA-BUF 帧缓冲区：灰度输出只拷贝 Y 平面，彩色输出由 cvtColor 直接从映射内存转换为 BGR，
+    随后立即归还缓冲区。（capture_array() 会先把整帧拷贝出来，因此不使用。）
+    """
+    def __init__(self, camera_id, width, height, fps):
+        self.picam2 = Picamera2(camera_id)
+        self.size = (width, height)
+        self.fps = fps
+        self.stride = width
+        self._configure()
+        self.picam2.start()
+
+    def _configure(self):
+        """
+        按当前分辨率与帧率配置视频流。queue=False 使每次取帧都等待新帧，
+        与 OpenCV 后端 CAP_PROP_BUFFERSIZE=1 的效果一致。
+        """
+        frame_us = int(1e6 / self.fps)
+        config = self.picam2.create_video_configuration(
+            main={"size": self.size, "format": "YUV420"}, queue=False,
+            controls={"FrameDurationLimits": (frame_us, frame_us)})
+        self.picam2.configure(config)
+        # create_video_configuration 已将尺寸对齐到 ISP 支持的值，实际分辨率与行跨度以生效配置为准
+        main = self.picam2.camera_config["main"]
+        self.size = tuple(main["size"])
+        self.stride = main["stride"]
+
+    def isOpened(self):
+        return self.picam2 is not None
+
+    def read(self, gray=False):
+        """
+        读取一帧。
+        :param gray: True 时返回 Y 平面灰度图，否则返回 BGR 彩色图
+        :return: (ret, frame)，与 cv2.VideoCapture.read() 相同
+        """
+        width, height = self.size
+        try:
+            request = self.picam2.capture_request()
+        except Exception as e:
+            logging.error(f"picamera2 取帧失败：{e}")
+            return False, None
+        try:
+            with MappedArray(request, "main") as m:
+                # 按行跨度解释映射内存：前 height 行为 Y 平面，其后为 U、V 平面（行跨度减半）
+                yuv = m.array.reshape(-1)[:height * 3 // 2 * self.stride].reshape(height * 3 // 2, self.stride)
+                if gray:
+                    frame = np.array(yuv[:height, :width])
+                else:
+                    frame = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420)
+                    if self.stride != width:
+                        frame = np.ascontiguousarray(frame[:, :width])
+        finally:
+            request.release()
+        return True, frame
+
+    def set(self, prop, value):
+        """
+        设置参数，将 OpenCV 属性映射为 libcamera 控制项；不支持的属性返回 False（与 OpenCV 一致）。
+        """
+        if prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT, cv2.CAP_PROP_FPS):
+            width, height = self.size
+            if prop == cv2.CAP_PROP_FRAME_WIDTH:
+                width = int(value)
+            elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+                height = int(value)
+            else:
+                self.fps = value
+            # 分辨率与帧率需停止视频流后重新配置
+            self.size = (width, height)
+            self.picam2.stop()
+            self._configure()
+            self.picam2.start()
+        elif prop == cv2.CAP_PROP_EXPOSURE:
+            # 沿用 V4L2 的约定：-1 为自动曝光，其余值表示 2^value 秒
+            if value == -1:
+                self.picam2.set_controls({"AeEnable": True})
+            else:
+                self.picam2.set_controls({"AeEnable": False, "ExposureTime": int(2 ** value * 1e6)})
+        elif prop == cv2.CAP_PROP_BRIGHTNESS:
+            # 0~255 映射到 libcamera 的 -1.0~1.0
+            self.picam2.set_controls({"Brightness": float(np.clip(value / 127.5 - 1.0, -1.0, 1.0))})
+        elif prop == cv2.CAP_PROP_CONTRAST:
+            # 以 50 为默认值，映射为 libcamera 的对比度倍率（1.0 为默认）
+            self.picam2.set_controls({"Contrast": value / 50.0})
+        else:
+            return False
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.size[0])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.size[1])
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        return 0.0
+
+    def release(self):
+        if self.picam2 is not None:
+            self.picam2.stop()
+            self.picam2.close()
+            self.picam2 = None
+
+class FaultyCallback:
+    """
+    回调函数包装器：捕获回调抛出的异常，日志按 log_interval 秒限频记录（其间的错误只计数），
+    连续失败达到 max_failures 次后标记为已失效，由驱动注销。
+    """
+    def __init__(self, func, max_failures=30, log_interval=1.0):
+        """
+        :param func: 被包装的回调函数
+        :param max_failures: 允许的连续失败次数，None 表示从不失效
+        :param log_interval: 两次错误日志之间的最短间隔（秒）
+        """
+        self.func = func
+        self.max_failures = max_failures
+        self.log_interval = log_interval
+        self.fail_count = 0        # 连续失败计数，成功调用后清零
+        self._suppressed = 0       # 上次记录日志后未记录的错误数
+        self._last_log = float('-inf')
+
+    @property
+    def exhausted(self):
+        """
+        连续失败次数是否已达到上限。
+        """
+        return self.max_failures is not None and self.fail_count >= self.max_failures
+
+    def __call__(self, data):
+        """
+        调用回调函数。
+        :return: 调用成功返回 True，回调抛出异常返回 False
+        """
+        try:
+            self.func(data)
+        except Exception as e:
+            self.fail_count += 1
+            now = time.monotonic()
+            if now - self._last_log >= self.log_interval:
+                skipped = f"，期间另有 {self._suppressed} 次错误未记录" if self._suppressed else ""
+                logging.error(f"回调函数处理帧时出错（连续 {self.fail_count} 次{skipped}）：{e}")
+                self._last_log = now
+                self._suppressed = 0
+            else:
+                self._suppressed += 1
+            return False
+        self.fail_count = 0
+        return True
+
 class CinemaDriver:
-    def __init__(self, camera_id=0, width=640, height=480, fps=30):
+    def __init__(self, camera_id=0, width=640, height=480, fps=30, preprocess_scale=1.0,
+                 pixel_format='BGR', shared_buffers=False, opencv_threads=2,
+                 capture_cpus=None, worker_cpus=None, backend='opencv'):
         """
         初始化摄像头参数，设置默认分辨率、帧率等参数。
         :param camera_id: 摄像头ID，默认 0
         :param width: 图像宽度
         :param height: 图像高度
         :param fps: 帧率
+        :param preprocess_scale: 预处理缓冲区的缩放比例（见 image_preprocessing.preprocess 的 scale）
+        :param pixel_format: 采集像素格式，取值见 PIXEL_FORMATS
+        :param shared_buffers: 预处理缓冲区是否放在共享内存中，供其他进程按名称零拷贝挂载
+                               （缓冲区不带跨进程同步，读取方式见 PreprocBuffers 的说明）
+        :param opencv_threads: OpenCV 内部并行线程数，None 表示不限制（默认占满所有核心）
+        :param capture_cpus: 采集线程绑定的 CPU 核心集合，如 {0}；None 表示不绑定
+        :param worker_cpus: 处理线程绑定的 CPU 核心集合，如 {1, 2, 3}；None 表示不绑定。
+                            OpenCV 的工作线程由处理线程首次调用时创建，会继承该绑定
+        :param backend: 采集后端，取值见 BACKENDS。picamera2 后端下 'YUYV' 表示回调接收
+                        YUV420 的 Y 平面灰度图
         """
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError(f"未知像素格式：{pixel_format}，可选值为 {PIXEL_FORMATS}")
+        if backend not in BACKENDS:
+            raise ValueError(f"未知采集后端：{backend}，可选值为 {BACKENDS}")
+        if backend == 'picamera2' and pixel_format == 'MJPG':
+            raise ValueError("picamera2 后端不支持 MJPG 格式。")
         self.camera_id = camera_id
         self.width = width
         self.height = height
         self.fps = fps
+        self.preprocess_scale = preprocess_scale
+        self.pixel_format = pixel_format
+        self.shared_buffers = shared_buffers
+        self.opencv_threads = opencv_threads
+        self.capture_cpus = capture_cpus
+        self.worker_cpus = worker_cpus
+        self.backend = backend
+        self.frame_size = (height, width)  # 实际输出分辨率 (高, 宽)，初始化摄像头后更新
 
         # 高级参数（部分参数需摄像头支持）
         self.exposure = -4         # 曝光值，-1表示自动曝光，数值根据硬件支持调整
@@ -43,34 +254,114 @@ class CinemaDriver:
         self.cap = None
         self.running = False
         self.capture_thread = None
+        self.process_thread = None
         self.callback = None       # 外部注册回调，处理每帧图像
+        self.batch_size = None     # 批量回调的批大小，None 表示逐帧回调
+        self._batch = None         # 批量回调的预分配帧数组 (batch, H, W[, C])
+        self._batch_fill = 0       # 当前批中已填入的帧数
         self.fail_count = 0        # 连续采集失败计数
+        self.buffers = None        # 预处理缓冲区，分辨率确定后分配，供回调中的 preprocess 跨帧复用
+        self._retired_buffers = [] # 已被替换、等待处理线程空闲时释放的缓冲区
+        self._retired_lock = threading.Lock()
+
+        # 采集线程与处理线程之间的单槽缓冲：新帧直接顶替未处理的旧帧
+        # （deque 的 append/pop 在 GIL 下是原子操作，无需额外加锁）
+        self._latest = deque(maxlen=1)
+        self._frame_ready = threading.Event()
 
     def initialize_camera(self):
         """
         初始化摄像头，设置基础与高级参数，并预热摄像头。
         """
         logging.info("初始化摄像头...")
-        self.cap = cv2.VideoCapture(self.camera_id)
-        if not self.cap.isOpened():
-            raise Exception("无法打开摄像头，请检查连接或更换摄像头ID。")
-
-        # 设置基本参数
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
-        self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+        if self.backend == 'picamera2':
+            if not PICAMERA2_AVAILABLE:
+                raise Exception("未安装 picamera2，无法使用 picamera2 后端。")
+            # 分辨率与帧率在配置视频流时一并设置
+            self.cap = _Picamera2Capture(self.camera_id, self.width, self.height, self.fps)
+        else:
+            self.cap = cv2.VideoCapture(self.camera_id)
+            if not self.cap.isOpened():
+                raise Exception("无法打开摄像头，请检查连接或更换摄像头ID。")
+
+            # 驱动内部只保留 1 帧缓冲：read() 总是拿到最新帧，而不是排队的旧帧
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+            # 像素格式：YUYV 时关闭 OpenCV 的自动 BGR 转换，直接拿到原始数据
+            if self.pixel_format == 'YUYV':
+                self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'YUYV'))
+                self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            elif self.pixel_format == 'MJPG':
+                self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+
+            # 设置基本参数
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+
+            # 确认驱动确实输出 YUYV：不支持时（如只能输出 MJPG 的 USB 摄像头）关闭转换拿到的并非 YUYV 数据，
+            # 此时恢复 OpenCV 的 BGR 转换并按 BGR 格式采集
+            if self.pixel_format == 'YUYV' and \
+                    int(self.cap.get(cv2.CAP_PROP_FOURCC)) != cv2.VideoWriter_fourcc(*'YUYV'):
+                logging.warning("摄像头不支持 YUYV 格式，改为按 BGR 格式采集。")
+                self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+                self.pixel_format = 'BGR'
         
         # 设置高级参数（部分参数可能需要根据摄像头型号验证是否生效）
         self.cap.set(cv2.CAP_PROP_EXPOSURE, float(self.exposure))
         self.cap.set(cv2.CAP_PROP_WHITE_BALANCE_BLUE_U, float(self.white_balance))
         self.cap.set(cv2.CAP_PROP_BRIGHTNESS, float(self.brightness))
         self.cap.set(cv2.CAP_PROP_CONTRAST, float(self.contrast))
+
+        # 按实际生效的分辨率分配预处理缓冲区
+        self._allocate_buffers()
         
         # 预热摄像头，确保图像稳定输出
         time.sleep(2)
         logging.info(f"摄像头初始化完成：ID={self.camera_id}, 分辨率={self.width}x{self.height}, FPS={self.fps}")
         self.fail_count = 0
 
+    def _allocate_buffers(self):
+        """
+        按摄像头实际输出分辨率分配预处理缓冲区（驱动可能不支持请求的分辨率）。
+        YUYV 格式下回调收到的是灰度图，按单通道分配。尺寸未变时（如异常重启后）沿用原缓冲区，
+        共享内存名称保持不变，已挂载的其他进程无需重新挂载。
+        """
+        actual_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or self.width
+        actual_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or self.height
+        self.frame_size = (actual_height, actual_width)
+        channels = 1 if self.pixel_format == 'YUYV' else 3
+        if self.buffers is not None:
+            if self.buffers.input_shape == (actual_height, actual_width, channels) and \
+                    self.buffers.scale == self.preprocess_scale:
+                return
+            self._retire_buffers(self.buffers)
+        self.buffers = PreprocBuffers.allocate(actual_height, actual_width, self.preprocess_scale,
+                                               channels, shared=self.shared_buffers)
+
+    def _retire_buffers(self, buffers):
+        """
+        停用一组缓冲区：未在采集时直接释放；采集过程中处理线程可能正在回调里使用它们，
+        不能立即解除映射，先登记下来，由处理线程在两帧之间（或线程结束后）释放。
+        """
+        with self._retired_lock:
+            self._retired_buffers.append(buffers)
+        if not self.running:
+            self._release_retired_buffers()
+
+    def _release_retired_buffers(self):
+        """
+        释放已停用的缓冲区；仍有视图被外部持有（close() 抛出 BufferError）的留待下次重试。
+        """
+        with self._retired_lock:
+            pending = []
+            for buffers in self._retired_buffers:
+                try:
+                    buffers.close()
+                except BufferError:
+                    pending.append(buffers)
+            self._retired_buffers = pending
+
     def set_camera_parameters(self, **params):
         """
         动态设置摄像头参数，支持分辨率、帧率、曝光、白平衡、亮度、对比度等。
@@ -104,39 +395,67 @@ class CinemaDriver:
                 self.cap.set(cv2.CAP_PROP_CONTRAST, float(value))
             else:
                 logging.warning(f"未知参数：{key}")
+        if 'width' in params or 'height' in params:
+            self._allocate_buffers()
         logging.info("摄像头参数更新完成。")
 
-    def register_callback(self, callback_func):
+    def register_callback(self, callback_func, batch_size=None, max_failures=30):
         """
-        注册回调函数，每采集一帧时调用该函数进行后续处理。
-        :param callback_func: 接受单帧图像（numpy数组）的函数
+        注册回调函数，由处理线程对最新采集到的帧调用；处理较慢时中间帧会被丢弃。
+        YUYV 格式下回调收到的是 Y 平面灰度图，其余格式为 BGR 彩色图。
+        
+        指定 batch_size 时，帧依次拷入预分配的批数组，攒满后一次性调用回调，
+        分摊逐帧调用与数据上传（如送入神经网络推理）的开销。批数组在各批之间复用，
+        回调返回后即被下一批覆盖，如需保留请自行拷贝。
+        
+        回调抛出的异常每秒最多记录一次日志，连续失败 max_failures 次后回调被自动注销。
+        :param callback_func: 接受单帧图像（numpy数组）的函数；批量模式下接受形状为
+                              (batch_size, H, W[, C]) 的数组
+        :param batch_size: 批大小，None 表示逐帧回调
+        :param max_failures: 连续失败多少次后注销回调，None 表示从不注销
         """
         if not callable(callback_func):
             raise ValueError("回调函数必须是可调用的。")
-        self.callback = callback_func
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("批大小必须为正整数。")
+        self.batch_size = batch_size
+        self._batch = None
+        self._batch_fill = 0
+        self.callback = FaultyCallback(callback_func, max_failures)
         logging.info("回调函数注册成功。")
 
     def start_capture(self):
         """
-        启动连续采集线程，持续采集图像并调用回调函数处理。
+        启动采集线程与处理线程：前者只负责读取最新帧，后者取帧并调用回调函数处理。
         """
         if self.cap is None:
             self.initialize_camera()
+        # 限制 OpenCV 内部线程数，为采集线程和系统保留 CPU 核心
+        if self.opencv_threads is not None:
+            cv2.setNumThreads(self.opencv_threads)
         self.running = True
+        self._latest.clear()
+        self._frame_ready.clear()
         self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.process_thread = threading.Thread(target=self._process_loop, daemon=True)
         self.capture_thread.start()
+        self.process_thread.start()
         logging.info("连续采集线程已启动。")
 
     def _capture_loop(self):
         """
-        内部采集主循环：连续采集图像，调用回调函数，同时处理采集异常。
+        内部采集主循环：连续采集图像并放入单槽缓冲，同时处理采集异常。
+        采集节奏由驱动的帧率决定，失败时按指数退避重试。
         """
+        self._pin_current_thread(self.capture_cpus, "采集线程")
         while self.running:
-            ret, frame = self.cap.read()
+            # 每帧判断格式：重新初始化时可能回退为 BGR
+            ret, frame = self._read(self.pixel_format == 'YUYV')
             if not ret or frame is None:
                 self.fail_count += 1
                 logging.error(f"图像采集失败，当前失败次数：{self.fail_count}")
-                time.sleep(0.1)
+                # 指数退避：0.1s、0.2s、0.4s……，最长 2s
+                time.sleep(min(0.1 * 2 ** (self.fail_count - 1), 2.0))
                 if self.fail_count >= 5:
                     logging.warning("连续采集失败次数过多，尝试重新初始化摄像头...")
                     self.release_camera()
@@ -147,22 +466,91 @@ class CinemaDriver:
                 continue
             self.fail_count = 0  # 成功采集后重置计数
 
+            # 交给处理线程；无需额外 sleep 控制速率，read() 本身会阻塞到驱动按设定帧率送出新帧
+            self._latest.append(frame)
+            self._frame_ready.set()
+
+    def _process_loop(self):
+        """
+        内部处理主循环：等待新帧到达，取出最新一帧调用回调函数进行后续处理。
+        """
+        self._pin_current_thread(self.worker_cpus, "处理线程")
+        while self.running:
+            # 两帧之间回调未在执行，可以安全释放已停用的缓冲区
+            if self._retired_buffers:
+                self._release_retired_buffers()
+            if not self._frame_ready.wait(timeout=0.5):
+                continue
+            self._frame_ready.clear()
+            try:
+                frame = self._latest.pop()
+            except IndexError:
+                continue
+
             # 调用回调函数进行后续处理
             if self.callback:
-                try:
-                    self.callback(frame)
-                except Exception as e:
-                    logging.error(f"回调函数处理帧时出错：{e}")
-            # 控制采集速率，尽可能接近设定帧率
-            time.sleep(1 / self.fps)
+                if self.batch_size:
+                    self._dispatch_batch(frame)
+                else:
+                    self._invoke_callback(frame)
+        self._release_retired_buffers()
+
+    @staticmethod
+    def _pin_current_thread(cpus, name):
+        """
+        将当前线程绑定到指定 CPU 核心（Linux 下 sched_setaffinity(0, ...) 只作用于调用线程）。
+        :param cpus: CPU 核心集合，None 表示不绑定
+        :param name: 线程名称，用于日志
+        """
+        if cpus is None:
+            return
+        if not hasattr(os, 'sched_setaffinity'):
+            logging.warning(f"当前平台不支持绑定 CPU 核心，{name}保持默认调度。")
+            return
+        try:
+            os.sched_setaffinity(0, set(cpus))
+            logging.info(f"{name}已绑定到 CPU 核心：{sorted(cpus)}")
+        except OSError as e:
+            logging.warning(f"{name}绑定 CPU 核心 {sorted(cpus)} 失败：{e}")
+
+    def _dispatch_batch(self, frame):
+        """
+        将帧拷入预分配的批数组，攒满 batch_size 帧后调用一次回调。
+        帧尺寸变化（如修改分辨率）时重新分配批数组并丢弃未满的批。
+        """
+        batch = self._batch
+        if batch is None or batch.shape[1:] != frame.shape or batch.dtype != frame.dtype:
+            batch = self._batch = np.empty((self.batch_size,) + frame.shape, dtype=frame.dtype)
+            self._batch_fill = 0
+        batch[self._batch_fill] = frame
+        self._batch_fill += 1
+        if self._batch_fill == self.batch_size:
+            self._batch_fill = 0
+            self._invoke_callback(batch)
+
+    def _invoke_callback(self, data):
+        """
+        调用回调函数处理单帧或一批图像；回调连续失败次数过多时将其注销。
+        """
+        callback = self.callback
+        if not callback(data) and callback.exhausted:
+            logging.error(f"回调函数连续失败 {callback.fail_count} 次，已注销。")
+            # 回调执行期间可能已注册了新的回调，此时不应覆盖
+            if self.callback is callback:
+                self.callback = None
 
     def stop_capture(self):
         """
-        停止连续采集线程，并等待线程结束。
+        停止采集线程与处理线程，并等待线程结束。
         """
         self.running = False
+        self._frame_ready.set()  # 唤醒等待中的处理线程
+        current = threading.current_thread()
+        for thread in (self.capture_thread, self.process_thread):
+            if thread is not None and thread is not current:
+                thread.join()
+        self._release_retired_buffers()
         if self.capture_thread is not None:
-            self.capture_thread.join()
             logging.info("连续采集线程已停止。")
 
     def get_frame(self):
@@ -172,30 +560,85 @@ class CinemaDriver:
         """
         if self.cap is None:
             raise Exception("摄像头未初始化，请先调用 initialize_camera()。")
-        ret, frame = self.cap.read()
+        ret, frame = self._read(gray=False)
+        if not ret or frame is None:
+            raise Exception("单帧采集失败。")
+        return frame
+
+    def get_gray_frame(self):
+        """
+        单帧灰度采集接口。YUYV 格式下直接取 Y 平面，无需任何颜色空间转换。
+        :return: 单帧灰度图像（numpy数组）
+        """
+        if self.cap is None:
+            raise Exception("摄像头未初始化，请先调用 initialize_camera()。")
+        ret, frame = self._read(gray=True)
         if not ret or frame is None:
             raise Exception("单帧采集失败。")
         return frame
 
+    def _read(self, gray):
+        """
+        从当前后端读取一帧，并转换为所需格式。
+        :param gray: True 时返回灰度图（YUYV/YUV420 下直接取 Y 平面），否则返回 BGR 彩色图
+        :return: (ret, frame)；格式转换失败（如原始数据尺寸不符）时视为采集失败，返回 (False, None)
+        """
+        if self.backend == 'picamera2':
+            return self.cap.read(gray)
+        ret, frame = self.cap.read()
+        if not ret or frame is None:
+            return ret, frame
+        try:
+            if self.pixel_format == 'YUYV':
+                if gray:
+                    return ret, self._y_plane(frame)
+                height, width = self.frame_size
+                return ret, cv2.cvtColor(frame.reshape(height, width, 2), cv2.COLOR_YUV2BGR_YUYV)
+            if gray:
+                return ret, cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        except (ValueError, cv2.error) as e:
+            logging.error(f"图像格式转换失败：{e}")
+            return False, None
+        return ret, frame
+
+    def _y_plane(self, raw):
+        """
+        从原始 YUYV 数据中提取亮度（Y）平面。
+        YUYV 每行按 Y0 U0 Y1 V0 ... 排列，偶数字节即为各像素的 Y 值。
+        :param raw: cap.read() 返回的原始 YUYV 数据
+        :return: C 连续的灰度图像
+        """
+        height, width = self.frame_size
+        return np.ascontiguousarray(raw.reshape(height, width * 2)[:, ::2])
+
     def release_camera(self):
         """
-        释放摄像头资源，关闭 VideoCapture 对象。
+        释放摄像头资源，关闭 VideoCapture（或 picamera2）对象；采集已停止时一并释放预处理缓冲区。
         """
         if self.cap is not None:
             self.cap.release()
             self.cap = None
             logging.info("摄像头资源已释放。")
+        # 采集过程中的异常重启会沿用缓冲区，仅在停止采集后释放
+        if not self.running and self.buffers is not None:
+            self._retire_buffers(self.buffers)
+            self.buffers = None
 
 
 # 示例：如何集成其他模块联动使用（请根据实际需求导入相应模块）
 if __name__ == '__main__':
-    # 示例回调函数：仅显示采集图像，并检测 'q' 键退出
+    from image_preprocessing import preprocess
+
+    # 示例回调函数：复用驱动分配的缓冲区进行预处理并显示，检测 'q' 键退出
     def process_frame(frame):
-        cv2.imshow("Cinema Driver - Processed Frame", frame)
+        processed = preprocess(frame, buffers=driver.buffers)
+        cv2.imshow("Cinema Driver - Processed Frame", processed)
         if cv2.waitKey(1) & 0xFF == ord('q'):
             driver.stop_capture()
 
-    driver = CinemaDriver(camera_id=0, width=640, height=480, fps=30)
+    # Pi 4 共 4 核：核心 0 专供采集，其余核心留给预处理
+    driver = CinemaDriver(camera_id=0, width=640, height=480, fps=30,
+                          capture_cpus={0}, worker_cpus={1, 2, 3})
     try:
         driver.initialize_camera()
         # 可通过 set_camera_parameters 动态调整参数（例如在弱光环境下调低曝光）
@@ -4,148 +4,583 @@ image_preprocessing.py
 ======================
 
 本模块负责对采集到的图像进行全面预处理，主要功能包括：
-    1. 彩色图像去噪（采用 fastNlMeansDenoisingColored 保持细节）
+    1. 彩色图像去噪（默认采用双边滤波保边去噪，可切换为 fastNlMeansDenoisingColored 或高斯模糊；
+       非局部均值去噪在有 CUDA / OpenCL 设备时自动转交 GPU 执行）
     2. 灰度转换，便于后续处理
     3. 对比度增强（采用自适应直方图均衡化 CLAHE 提升细节表现）
     4. 高斯平滑与 Canny 边缘检测，提取关键边缘信息
     5. 形态学处理（闭运算）去除噪点，增强目标轮廓
     6. 最终合并边缘信息与均衡图，形成稳定的预处理图像
 
-支持动态参数调整与调试显示，可通过 debug 模式观察各处理阶段效果，便于调优。
+其中第 4~6 步可通过 fused=True 切换为 fast_kernels 中的 Numba 融合内核，一次遍历完成；
+加速内核可用时（已安装 Numba 或已预编译）第 3 步自动使用 CLAHE 内核，
+否则将图像按行切成 CLAHE_STRIPS 个条带，由线程池并行执行 OpenCV CLAHE。
+可通过 scale 参数先缩小图像再处理，最后将结果放大回原分辨率（非局部均值去噪时默认减半）。
+输入也可以直接是灰度图（如摄像头 YUYV 格式的 Y 平面），此时跳过第 2 步的颜色转换。
+
+支持动态参数调整与调试显示，可通过 debug 模式观察各处理阶段效果，便于调优；
+调试显示将各阶段拼接为一幅拼图，每 debug_every 帧刷新一次，避免窗口刷新拖慢处理流程。
 """
 
 import cv2
 import numpy as np
+import functools
+import itertools
 import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+
+from fast_kernels import KERNELS_AVAILABLE, CLAHE_TILES, clahe_u8, fused_tail
 
 # 配置日志输出
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
 
-def preprocess(image, debug=False):
+# 模块日志：逐帧的阶段日志使用 DEBUG 级别，默认的 INFO 级别下不产生格式化与加锁开销
+_log = logging.getLogger(__name__)
+
+# 支持的去噪方式：'nlm'（非局部均值，效果最好但在树莓派上极慢）、
+# 'bilateral'（双边滤波，保边且快 1~2 个数量级）、'gaussian'（高斯模糊，最快）
+DENOISE_MODES = ('nlm', 'bilateral', 'gaussian')
+
+# 闭运算使用的 3×3 矩形结构元素，模块加载时创建一次
+_KERN3 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+# OpenCV 回退路径下 CLAHE 按行切分的条带数（默认取核心数，最多 4 个），设为 1 关闭条带并行
+CLAHE_STRIPS = min(4, os.cpu_count() or 1)
+
+# 条带并行使用的线程池（首次使用时创建）与各线程私有的 CLAHE 对象（CLAHE 对象非线程安全）
+_clahe_pool = None
+_clahe_pool_lock = threading.Lock()
+_clahe_local = threading.local()
+
+# 每个线程最多缓存的 CLAHE 对象数，超出时淘汰最久未使用的（调参时参数组合会不断变化）
+_CLAHE_CACHE_SIZE = 8
+
+# 缓冲区在内存块中的对齐字节数（缓存行大小）
+_SLAB_ALIGN = 64
+
+@dataclass
+class PreprocBuffers:
+    """
+    预处理各阶段的持久输出缓冲区。
+    
+    分辨率确定后分配一次，逐帧通过 dst= 传给 OpenCV 复用，避免每帧重复分配
+    约 7 幅整图大小的临时数组。各阶段缓冲区按处理分辨率（原分辨率 × scale）分配；
+    scale 不为 1 时另有缩小后的输入 resized 与放大回原分辨率的结果 upscaled。
+    输入为灰度图时按 channels=1 分配，denoised 与 resized 为单通道。
+    
+    所有缓冲区都是同一块连续内存 slab 上按流水线顺序切出的视图，相邻阶段访问相邻的
+    物理页，有利于树莓派的 L2 缓存与 TLB。slab 可由 multiprocessing.shared_memory
+    提供，其他进程通过 attach() 按名称零拷贝访问同一组缓冲区，无需 pickle 传输图像。
+    
+    注意：preprocess 返回的结果即 out（或 upscaled）缓冲区本身，下一帧会被覆盖，
+    如需保留请自行拷贝。共享内存本身不带任何同步，生产方写入下一帧时消费方可能读到
+    写了一半的图像：须由双方自行同步，例如生产方在 preprocess 返回后通过
+    multiprocessing.Queue 发送帧序号，消费方拷出结果后再回复确认，生产方收到确认前不处理下一帧。
+    """
+    denoised: np.ndarray
+    gray: np.ndarray
+    equalized: np.ndarray
+    blurred: np.ndarray
+    edges: np.ndarray
+    morphed: np.ndarray
+    out: np.ndarray
+    scale: float = 1.0
+    resized: np.ndarray = None
+    upscaled: np.ndarray = None
+    input_shape: tuple = None      # 输入图像形状 (高, 宽, 通道数)
+    slab: np.ndarray = None        # 承载全部缓冲区的连续内存块
+    shm: shared_memory.SharedMemory = None
+    shm_owner: bool = False        # 是否由本实例创建共享内存（负责 unlink）
+
+    @classmethod
+    def allocate(cls, height, width, scale=1.0, channels=3, shared=False):
+        """
+        按图像尺寸分配全部缓冲区。
+        :param height: 输入图像高度
+        :param width: 输入图像宽度
+        :param scale: 处理时的缩放比例
+        :param channels: 输入图像通道数，3 为 BGR 彩色图，1 为灰度图
+        :param shared: 是否使用共享内存承载，便于跨进程零拷贝访问
+        :return: PreprocBuffers 实例
+        """
+        layout, total = _slab_layout(height, width, scale, channels)
+        if shared:
+            shm = shared_memory.SharedMemory(create=True, size=total)
+            slab = np.frombuffer(shm.buf, dtype=np.uint8, count=total)
+        else:
+            shm = None
+            slab = np.empty(total, dtype=np.uint8)
+        return cls._from_slab(slab, layout, height, width, scale, channels, shm, shared)
+
+    @classmethod
+    def attach(cls, name, height, width, scale=1.0, channels=3):
+        """
+        在其他进程中按名称挂载已创建的共享缓冲区，参数须与创建时一致。
+        :param name: 共享内存名称（创建方的 buffers.shm.name）
+        :return: PreprocBuffers 实例
+        """
+        layout, total = _slab_layout(height, width, scale, channels)
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+            # 3.12 及以前挂载方也会登记到本进程的 resource_tracker，进程退出时共享内存会被 unlink，
+            # 创建方与其他消费方随之失效；共享内存的生命周期只由创建方负责，此处取消登记
+            if os.name == 'posix':
+                resource_tracker.unregister(shm._name, 'shared_memory')
+        slab = np.frombuffer(shm.buf, dtype=np.uint8, count=total)
+        return cls._from_slab(slab, layout, height, width, scale, channels, shm, False)
+
+    @classmethod
+    def _from_slab(cls, slab, layout, height, width, scale, channels, shm, shm_owner):
+        """
+        按布局在内存块上切出各阶段缓冲区视图。
+        """
+        views = {name: slab[offset:offset + int(np.prod(shape))].reshape(shape)
+                 for name, shape, offset in layout}
+        return cls(scale=scale, input_shape=(height, width, channels), slab=slab,
+                   shm=shm, shm_owner=shm_owner,
+                   resized=views.pop('resized', None), upscaled=views.pop('upscaled', None),
+                   **views)
+
+    def close(self):
+        """
+        释放共享内存（非共享分配时无操作）；创建方会同时 unlink 共享内存。
+        
+        本实例的缓冲区视图随即失效。外部仍持有视图（如保存了 preprocess 的返回结果）时
+        拒绝解除映射并抛出 BufferError，以免这些视图指向已释放的内存；
+        释放这些引用后可再次调用。
+        """
+        if self.shm is None:
+            return
+        for name in ('resized', 'denoised', 'gray', 'equalized', 'blurred',
+                     'edges', 'morphed', 'out', 'upscaled', 'slab'):
+            setattr(self, name, None)
+        # slab 由 np.frombuffer 创建并持有共享内存的缓冲区导出，仍有视图存活时 close() 抛出 BufferError
+        try:
+            self.shm.close()
+        except BufferError:
+            raise BufferError("仍有缓冲区视图被外部持有，暂不能释放共享内存。") from None
+        if self.shm_owner:
+            self.shm.unlink()
+        self.shm = None
+
+def _slab_layout(height, width, scale, channels):
+    """
+    计算各缓冲区在连续内存块中的布局，按流水线顺序排列并按缓存行对齐。
+    :return: ([(名称, 形状, 偏移)], 总字节数)
+    """
+    h, w = _scaled_size(height, width, scale)
+    color_shape = (h, w, 3) if channels == 3 else (h, w)
+    shapes = [('denoised', color_shape), ('gray', (h, w)), ('equalized', (h, w)),
+              ('blurred', (h, w)), ('edges', (h, w)), ('morphed', (h, w)), ('out', (h, w))]
+    if scale != 1.0:
+        shapes = [('resized', color_shape)] + shapes + [('upscaled', (height, width))]
+    layout = []
+    offset = 0
+    for name, shape in shapes:
+        layout.append((name, shape, offset))
+        size = int(np.prod(shape))
+        offset += (size + _SLAB_ALIGN - 1) // _SLAB_ALIGN * _SLAB_ALIGN
+    return layout, offset
+
+def _scaled_size(height, width, scale):
+    """
+    计算按比例缩放后的图像尺寸 (高, 宽)。
+    """
+    return max(int(round(height * scale)), 1), max(int(round(width * scale)), 1)
+
+def _resolve_scale(scale, denoise_mode, buffers):
+    """
+    确定处理缩放比例：显式指定时直接使用；否则沿用缓冲区的比例；
+    都未提供时，非局部均值去噪默认减半（计算量降为 1/4），其余方式保持原分辨率。
+    """
+    if scale is not None:
+        return scale
+    if buffers is not None:
+        return buffers.scale
+    return 0.5 if denoise_mode == 'nlm' else 1.0
+
+def _get_buffers(image, buffers, scale=1.0):
+    """
+    返回与输入图像尺寸、缩放比例匹配的缓冲区；未提供时临时分配一组。
+    """
+    channels = image.shape[2] if image.ndim == 3 else 1
+    if buffers is None:
+        return PreprocBuffers.allocate(image.shape[0], image.shape[1], scale, channels)
+    expected = _scaled_size(image.shape[0], image.shape[1], scale)
+    if buffers.scale != scale or buffers.gray.shape != expected or \
+            buffers.denoised.shape[2:] != image.shape[2:]:
+        raise ValueError(f"缓冲区（尺寸 {buffers.gray.shape}，缩放 {buffers.scale}）与输入图像"
+                         f"（形状 {image.shape}，缩放 {scale}）不匹配。")
+    return buffers
+
+def _downscale(image, bufs):
+    """
+    按缓冲区的缩放比例缩小输入图像（INTER_AREA 抗混叠）；比例为 1 时原样返回。
+    """
+    if bufs.scale == 1.0:
+        return image
+    h, w = bufs.gray.shape
+    return cv2.resize(image, (w, h), dst=bufs.resized, interpolation=cv2.INTER_AREA)
+
+def _upscale(result, image, bufs):
+    """
+    将处理结果放大回输入图像的原分辨率；比例为 1 时原样返回。
+    """
+    if bufs.scale == 1.0:
+        return result
+    return cv2.resize(result, (image.shape[1], image.shape[0]), dst=bufs.upscaled,
+                      interpolation=cv2.INTER_LINEAR)
+
+@functools.lru_cache(maxsize=1)
+def _nlm_device():
+    """
+    检测非局部均值去噪可用的计算设备（仅检测一次）：
+      'cuda'   - OpenCV 带 CUDA 模块且有可用设备（如 Jetson）；
+      'opencl' - 可通过 T-API（UMat）调度到 OpenCL 设备（如 Pi 4 的 VideoCore VI）；
+      'cpu'    - 以上均不可用。
+    """
+    try:
+        if cv2.cuda.getCudaEnabledDeviceCount() > 0 and hasattr(cv2.cuda, 'fastNlMeansDenoisingColored'):
+            device = 'cuda'
+        else:
+            device = None
+    except (AttributeError, cv2.error):
+        device = None
+    if device is None:
+        if cv2.ocl.haveOpenCL():
+            cv2.ocl.setUseOpenCL(True)
+        device = 'opencl' if cv2.ocl.useOpenCL() else 'cpu'
+    _log.info(f"非局部均值去噪使用设备：{device}")
+    return device
+
+def _nlm_denoise(image, h, hColor, dst=None):
+    """
+    非局部均值去噪，按 _nlm_device() 的检测结果在 CUDA、OpenCL 或 CPU 上执行，
+    把计算最密集的环节移出 ARM 核心，留给 CLAHE、Canny 等后续步骤。
+    """
+    device = _nlm_device()
+    if device == 'cuda':
+        gpu = cv2.cuda_GpuMat()
+        gpu.upload(image)
+        if image.ndim == 2:
+            result = cv2.cuda.fastNlMeansDenoising(gpu, h, search_window=21, block_size=7)
+        else:
+            result = cv2.cuda.fastNlMeansDenoisingColored(gpu, h, hColor, search_window=21, block_size=7)
+        return result.download(dst) if dst is not None else result.download()
+    if device == 'opencl':
+        umat = cv2.UMat(image)
+        if image.ndim == 2:
+            result = cv2.fastNlMeansDenoising(umat, None, h=h, templateWindowSize=7, searchWindowSize=21)
+        else:
+            result = cv2.fastNlMeansDenoisingColored(umat, None, h=h, hColor=hColor,
+                                                     templateWindowSize=7, searchWindowSize=21)
+        if dst is None:
+            return result.get()
+        np.copyto(dst, result.get())
+        return dst
+    if image.ndim == 2:
+        return cv2.fastNlMeansDenoising(image, dst, h=h, templateWindowSize=7, searchWindowSize=21)
+    return cv2.fastNlMeansDenoisingColored(image, dst, h=h, hColor=hColor,
+                                           templateWindowSize=7, searchWindowSize=21)
+
+def _denoise(image, mode='bilateral', h=10, hColor=10, dst=None):
+    """
+    按指定方式对图像去噪，支持 BGR 彩色图与灰度图。
+    
+    fastNlMeansDenoisingColored 的复杂度约为 O(W·H·search²·template²)，
+    在 Pi 4 上处理一帧 640×480 图像通常超过 500 ms，是整个流程的主要耗时；
+    双边滤波同样保留边缘，足以满足后续 Canny 边缘检测的需要。
+    
+    :param image: 输入图像（BGR 格式或灰度图）
+    :param mode: 去噪方式，取值见 DENOISE_MODES
+    :param h: 非局部均值去噪参数 h（仅 'nlm' 模式使用）
+    :param hColor: 非局部均值去噪参数 hColor（仅 'nlm' 模式使用）
+    :param dst: 可选的输出缓冲区
+    :return: 去噪后的图像
+    """
+    if mode == 'nlm':
+        return _nlm_denoise(image, h, hColor, dst)
+    if mode == 'bilateral':
+        return cv2.bilateralFilter(image, d=5, sigmaColor=50, sigmaSpace=50, dst=dst)
+    if mode == 'gaussian':
+        return cv2.GaussianBlur(image, (5, 5), 0, dst=dst)
+    raise ValueError(f"未知去噪方式：{mode}，可选值为 {DENOISE_MODES}")
+
+def _thread_clahe(clipLimit, tileGridSize):
+    """
+    返回当前线程私有的 CLAHE 对象，按参数缓存，避免每帧重复创建 C++ 对象（tileGridSize 须为元组）。
+    CLAHE 对象在 apply 时会改写内部暂存，不能被多个线程同时使用，因此每个线程各持一份，
+    每份最多 _CLAHE_CACHE_SIZE 个，按最近使用顺序淘汰。
+    """
+    cache = getattr(_clahe_local, 'cache', None)
+    if cache is None:
+        cache = _clahe_local.cache = OrderedDict()
+    key = (clipLimit, tileGridSize)
+    clahe = cache.get(key)
+    if clahe is None:
+        clahe = cache[key] = cv2.createCLAHE(clipLimit=clipLimit, tileGridSize=tileGridSize)
+        if len(cache) > _CLAHE_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+    return clahe
+
+def _equalize_strips(gray, clipLimit, tileGridSize, strips, dst=None):
+    """
+    按分块行将图像切成 strips 个条带，由线程池并行执行 CLAHE，结果写入 dst 的对应行。
+    
+    每个条带上下各多带一行分块，分块划分与整图一致，条带交界处的插值也能取到相邻分块，
+    结果与整图处理相同。OpenCV 执行时释放 GIL，线程可并行。
+    """
+    global _clahe_pool
+    if _clahe_pool is None:
+        with _clahe_pool_lock:
+            if _clahe_pool is None:
+                _clahe_pool = ThreadPoolExecutor(max_workers=strips, thread_name_prefix='clahe')
+    if dst is None:
+        dst = np.empty_like(gray)
+    tiles_x, tiles_y = tileGridSize
+    tile_h = gray.shape[0] // tiles_y
+    per_strip = tiles_y // strips
+    # 含上下重叠分块时条带的最大行数（中间条带），各线程的暂存按此分配一次，边缘条带取其前若干行
+    scratch_rows = min(per_strip + 2, tiles_y) * tile_h
+
+    def apply_strip(i):
+        t0 = max(i * per_strip - 1, 0)
+        t1 = min((i + 1) * per_strip + 1, tiles_y)
+        src = gray[t0 * tile_h:t1 * tile_h]
+        # 含重叠分块的结果先写入线程私有缓冲区，只把本条带的行复制到 dst，避免相邻条带写冲突
+        scratch = getattr(_clahe_local, 'scratch', None)
+        if scratch is None or scratch.shape[0] < scratch_rows or scratch.shape[1:] != src.shape[1:]:
+            scratch = _clahe_local.scratch = np.empty((scratch_rows,) + src.shape[1:], dtype=src.dtype)
+        scratch = scratch[:src.shape[0]]
+        _thread_clahe(clipLimit, (tiles_x, t1 - t0)).apply(src, dst=scratch)
+        r0 = i * per_strip * tile_h
+        r1 = r0 + per_strip * tile_h
+        off = r0 - t0 * tile_h
+        dst[r0:r1] = scratch[off:off + r1 - r0]
+
+    list(_clahe_pool.map(apply_strip, range(strips)))
+    return dst
+
+def _equalize(gray, clipLimit=2.0, tileGridSize=(8, 8), dst=None):
+    """
+    CLAHE 对比度增强。加速内核可用、分块为 8×8 且图像尺寸能被分块整除时使用多核并行的
+    clahe_u8 内核（结果与 OpenCV 相差不超过 1 个灰度级）；否则使用 OpenCV 实现，
+    行分块数与图像高度均能按 CLAHE_STRIPS 整齐切分时按条带并行执行。
+    
+    :param gray: 输入灰度图
+    :param clipLimit: CLAHE 的 clipLimit
+    :param tileGridSize: CLAHE 的 tileGridSize
+    :param dst: 可选的输出缓冲区
+    :return: 均衡化后的图像
+    """
+    h, w = gray.shape
+    if (KERNELS_AVAILABLE and tuple(tileGridSize) == (CLAHE_TILES, CLAHE_TILES)
+            and h % CLAHE_TILES == 0 and w % CLAHE_TILES == 0):
+        return clahe_u8(gray, out=dst, clip_limit=clipLimit)
+    tiles_x, tiles_y = tileGridSize
+    strips = CLAHE_STRIPS
+    if strips > 1 and tiles_y % strips == 0 and h % tiles_y == 0:
+        return _equalize_strips(gray, clipLimit, (tiles_x, tiles_y), strips, dst)
+    return _thread_clahe(clipLimit, tuple(tileGridSize)).apply(gray, dst=dst)
+
+# 调试拼图每行显示的阶段数
+_DEBUG_COLS = 3
+
+# 调试帧计数，用于按间隔刷新调试拼图
+_debug_counter = itertools.count()
+
+def _debug_stages(debug, debug_every):
+    """
+    本帧需要刷新调试拼图时返回收集各阶段图像的列表，否则返回 None。
+    """
+    if debug and next(_debug_counter) % max(debug_every, 1) == 0:
+        return []
+    return None
+
+def _show_debug(window, stages):
+    """
+    将各阶段图像缩放到同一尺寸、标注名称后拼接为一幅图，仅调用一次 imshow 与 waitKey。
+    :param window: 窗口名称
+    :param stages: [(阶段名称, 图像)] 列表
+    """
+    h, w = stages[0][1].shape[:2]
+    tiles = []
+    for name, img in stages:
+        if img.shape[:2] != (h, w):
+            img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) if img.ndim == 2 else img.copy()
+        cv2.putText(img, name, (5, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 1)
+        tiles.append(img)
+    while len(tiles) % _DEBUG_COLS:
+        tiles.append(np.zeros_like(tiles[0]))
+    rows = [np.hstack(tiles[i:i + _DEBUG_COLS]) for i in range(0, len(tiles), _DEBUG_COLS)]
+    cv2.imshow(window, np.vstack(rows))
+    cv2.waitKey(1)
+
+def preprocess(image, debug=False, denoise_mode='bilateral', fused=False, buffers=None, scale=None,
+               debug_every=5):
     """
     主预处理流程，对输入图像进行一系列处理，得到用于目标检测的高质量图像。
     
     流程：
-      1. 去噪：使用 fastNlMeansDenoisingColored 去除噪声同时保留颜色细节。
+      1. 去噪：默认使用双边滤波去除噪声同时保留边缘，可通过 denoise_mode 切换。
       2. 灰度转换：将去噪后的图像转换为灰度图。
       3. 对比度增强：采用 CLAHE 自适应直方图均衡化提高图像对比度。
       4. 高斯模糊与边缘检测：先平滑图像，再通过 Canny 算法提取边缘。
       5. 形态学处理：利用闭运算消除边缘检测中的小噪点。
       6. 合成：将增强后的灰度图与形态学处理结果融合，得到最终预处理图像。
     
-    :param image: 输入图像，要求为 BGR 格式
-    :param debug: 是否开启调试模式（显示中间处理结果）
-    :return: 预处理后的图像
+    :param image: 输入图像，BGR 格式或灰度图（灰度图跳过颜色转换）
+    :param debug: 是否开启调试模式（以拼图形式显示中间处理结果）
+    :param denoise_mode: 去噪方式，'nlm' | 'bilateral' | 'gaussian'
+    :param fused: 是否使用 Numba 融合内核完成第 4~6 步（内核不可用时自动回退到 OpenCV）
+    :param buffers: 可选的 PreprocBuffers，跨帧复用各阶段输出（返回值即其中的缓冲区）；
+                    为 None 时每次临时分配，返回独立数组
+    :param scale: 处理缩放比例；为 None 时沿用 buffers 的比例，否则 'nlm' 去噪默认 0.5、其余为 1.0
+    :param debug_every: 调试模式下每隔多少帧刷新一次调试拼图
+    :return: 预处理后的图像（与输入同分辨率）
     """
     if image is None:
         raise ValueError("输入图像为空，请检查数据源。")
+    bufs = _get_buffers(image, buffers, _resolve_scale(scale, denoise_mode, buffers))
+    src = _downscale(image, bufs)
+    stages = _debug_stages(debug, debug_every)
 
     # 1. 去噪处理
-    denoised = cv2.fastNlMeansDenoisingColored(image, None, h=10, hColor=10, templateWindowSize=7, searchWindowSize=21)
-    logging.info("图像去噪完成。")
-    if debug:
-        cv2.imshow("Step 1 - Denoised", denoised)
-        cv2.waitKey(1)
+    denoised = _denoise(src, denoise_mode, dst=bufs.denoised)
+    _log.debug("图像去噪完成。")
+    if stages is not None:
+        stages.append(("Denoised", denoised))
 
-    # 2. 灰度转换
-    gray = cv2.cvtColor(denoised, cv2.COLOR_BGR2GRAY)
-    logging.info("灰度转换完成。")
-    if debug:
-        cv2.imshow("Step 2 - Grayscale", gray)
-        cv2.waitKey(1)
+    # 2. 灰度转换（输入已是灰度图时直接使用）
+    if denoised.ndim == 2:
+        gray = denoised
+    else:
+        gray = cv2.cvtColor(denoised, cv2.COLOR_BGR2GRAY, dst=bufs.gray)
+    _log.debug("灰度转换完成。")
+    if stages is not None:
+        stages.append(("Grayscale", gray))
 
     # 3. 对比度增强 - 使用 CLAHE 自适应直方图均衡化
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    equalized = clahe.apply(gray)
-    logging.info("对比度增强（CLAHE）完成。")
-    if debug:
-        cv2.imshow("Step 3 - Equalized", equalized)
-        cv2.waitKey(1)
-
-    # 4. 高斯模糊平滑 + Canny 边缘检测
-    blurred = cv2.GaussianBlur(equalized, (5, 5), 0)
-    edges = cv2.Canny(blurred, threshold1=50, threshold2=150)
-    logging.info("高斯平滑与边缘检测完成。")
-    if debug:
-        cv2.imshow("Step 4 - Edges", edges)
-        cv2.waitKey(1)
-
-    # 5. 形态学处理 - 闭运算去除小噪点，保留连续边缘
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-    morphed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel, iterations=1)
-    logging.info("形态学处理完成。")
-    if debug:
-        cv2.imshow("Step 5 - Morphology", morphed)
-        cv2.waitKey(1)
-
-    # 6. 融合处理：将 CLAHE 图与形态学边缘图按比例融合
-    preprocessed = cv2.addWeighted(equalized, 0.8, morphed, 0.2, 0)
-    logging.info("图像预处理整体完成。")
-    if debug:
-        cv2.imshow("Final Preprocessed", preprocessed)
-        cv2.waitKey(1)
+    equalized = _equalize(gray, dst=bufs.equalized)
+    _log.debug("对比度增强（CLAHE）完成。")
+    if stages is not None:
+        stages.append(("Equalized", equalized))
+
+    if fused and KERNELS_AVAILABLE:
+        # 4~6. 融合内核：平滑、边缘、闭运算与融合一次遍历完成，不生成中间图像
+        preprocessed = fused_tail(equalized, out=bufs.out, t1=50, t2=150)
+        _log.debug("图像预处理整体完成（融合内核）。")
+    else:
+        # 4. 高斯模糊平滑 + Canny 边缘检测
+        blurred = cv2.GaussianBlur(equalized, (5, 5), 0, dst=bufs.blurred)
+        edges = cv2.Canny(blurred, threshold1=50, threshold2=150, edges=bufs.edges)
+        _log.debug("高斯平滑与边缘检测完成。")
+        if stages is not None:
+            stages.append(("Edges", edges))
+
+        # 5. 形态学处理 - 闭运算去除小噪点，保留连续边缘
+        morphed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, _KERN3, dst=bufs.morphed, iterations=1)
+        _log.debug("形态学处理完成。")
+        if stages is not None:
+            stages.append(("Morphology", morphed))
+
+        # 6. 融合处理：将 CLAHE 图与形态学边缘图按比例融合
+        preprocessed = cv2.addWeighted(equalized, 0.8, morphed, 0.2, 0, dst=bufs.out)
+        _log.debug("图像预处理整体完成。")
+
+    # 缩小处理时将结果放大回原分辨率
+    preprocessed = _upscale(preprocessed, image, bufs)
+    # 缓冲区为本次临时分配时返回独立数组，避免结果视图使整块缓冲区内存无法释放
+    if buffers is None:
+        preprocessed = preprocessed.copy()
+    if stages is not None:
+        stages.append(("Final Preprocessed", preprocessed))
+        _show_debug("Preprocess - Debug", stages)
 
     return preprocessed
 
 def adjust_parameters(image, denoise_h=10, denoise_hColor=10, clipLimit=2.0, tileGridSize=(8, 8),
-                      canny_thresh1=50, canny_thresh2=150, debug=False):
+                      canny_thresh1=50, canny_thresh2=150, debug=False, denoise_mode='bilateral',
+                      fused=False, buffers=None, scale=None, debug_every=5):
     """
     提供可调参数版本的预处理函数，便于通过参数调节获得最优预处理效果。
     
-    :param image: 输入图像（BGR 格式）
-    :param denoise_h: 彩色去噪参数 h
-    :param denoise_hColor: 彩色去噪参数 hColor
+    :param image: 输入图像（BGR 格式或灰度图）
+    :param denoise_h: 彩色去噪参数 h（仅 'nlm' 模式使用）
+    :param denoise_hColor: 彩色去噪参数 hColor（仅 'nlm' 模式使用）
     :param clipLimit: CLAHE 的 clipLimit
     :param tileGridSize: CLAHE 的 tileGridSize
     :param canny_thresh1: Canny 算法下阈值
     :param canny_thresh2: Canny 算法上阈值
     :param debug: 是否开启调试显示
-    :return: 预处理后的图像
+    :param denoise_mode: 去噪方式，'nlm' | 'bilateral' | 'gaussian'
+    :param fused: 是否使用 Numba 融合内核完成平滑、边缘、形态学与融合步骤
+    :param buffers: 可选的 PreprocBuffers，跨帧复用各阶段输出
+    :param scale: 处理缩放比例，规则同 preprocess
+    :param debug_every: 调试模式下每隔多少帧刷新一次调试拼图
+    :return: 预处理后的图像（与输入同分辨率）
     """
     if image is None:
         raise ValueError("输入图像为空，请检查数据源。")
+    bufs = _get_buffers(image, buffers, _resolve_scale(scale, denoise_mode, buffers))
+    src = _downscale(image, bufs)
+    stages = _debug_stages(debug, debug_every)
     
     # 1. 去噪
-    denoised = cv2.fastNlMeansDenoisingColored(image, None, h=denoise_h, hColor=denoise_hColor,
-                                                templateWindowSize=7, searchWindowSize=21)
-    if debug:
-        cv2.imshow("Adjust - Denoised", denoised)
-        cv2.waitKey(1)
+    denoised = _denoise(src, denoise_mode, h=denoise_h, hColor=denoise_hColor, dst=bufs.denoised)
+    if stages is not None:
+        stages.append(("Denoised", denoised))
 
     # 2. 灰度转换
-    gray = cv2.cvtColor(denoised, cv2.COLOR_BGR2GRAY)
-    if debug:
-        cv2.imshow("Adjust - Grayscale", gray)
-        cv2.waitKey(1)
+    if denoised.ndim == 2:
+        gray = denoised
+    else:
+        gray = cv2.cvtColor(denoised, cv2.COLOR_BGR2GRAY, dst=bufs.gray)
+    if stages is not None:
+        stages.append(("Grayscale", gray))
 
     # 3. 对比度增强
-    clahe = cv2.createCLAHE(clipLimit=clipLimit, tileGridSize=tileGridSize)
-    equalized = clahe.apply(gray)
-    if debug:
-        cv2.imshow("Adjust - Equalized", equalized)
-        cv2.waitKey(1)
-
-    # 4. 高斯平滑与边缘检测
-    blurred = cv2.GaussianBlur(equalized, (5, 5), 0)
-    edges = cv2.Canny(blurred, threshold1=canny_thresh1, threshold2=canny_thresh2)
-    if debug:
-        cv2.imshow("Adjust - Edges", edges)
-        cv2.waitKey(1)
-
-    # 5. 形态学处理
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-    morphed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel, iterations=1)
-    if debug:
-        cv2.imshow("Adjust - Morphology", morphed)
-        cv2.waitKey(1)
-
-    # 6. 融合
-    preprocessed = cv2.addWeighted(equalized, 0.8, morphed, 0.2, 0)
-    if debug:
-        cv2.imshow("Adjust - Final Preprocessed", preprocessed)
-        cv2.waitKey(1)
-
-    logging.info("自定义参数图像预处理完成。")
+    equalized = _equalize(gray, clipLimit, tileGridSize, dst=bufs.equalized)
+    if stages is not None:
+        stages.append(("Equalized", equalized))
+
+    if fused and KERNELS_AVAILABLE:
+        # 4~6. 融合内核
+        preprocessed = fused_tail(equalized, out=bufs.out, t1=canny_thresh1, t2=canny_thresh2)
+    else:
+        # 4. 高斯平滑与边缘检测
+        blurred = cv2.GaussianBlur(equalized, (5, 5), 0, dst=bufs.blurred)
+        edges = cv2.Canny(blurred, threshold1=canny_thresh1, threshold2=canny_thresh2, edges=bufs.edges)
+        if stages is not None:
+            stages.append(("Edges", edges))
+
+        # 5. 形态学处理
+        morphed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, _KERN3, dst=bufs.morphed, iterations=1)
+        if stages is not None:
+            stages.append(("Morphology", morphed))
+
+        # 6. 融合
+        preprocessed = cv2.addWeighted(equalized, 0.8, morphed, 0.2, 0, dst=bufs.out)
+
+    preprocessed = _upscale(preprocessed, image, bufs)
+    if buffers is None:
+        preprocessed = preprocessed.copy()
+    if stages is not None:
+        stages.append(("Final Preprocessed", preprocessed))
+        _show_debug("Adjust - Debug", stages)
+
+    _log.debug("自定义参数图像预处理完成。")
     return preprocessed
 
 if __name__ == '__main__':
@@ -160,7 +595,7 @@ if __name__ == '__main__':
     if image is None:
         raise Exception("无法加载图像，请检查路径或文件格式。")
     
-    # 调用主预处理函数（开启调试模式显示每一步骤效果）
+    # 调用主预处理函数（开启调试模式，以拼图显示每一步骤效果）
     result = preprocess(image, debug=True)
     
     cv2.imshow("Final Result", result)
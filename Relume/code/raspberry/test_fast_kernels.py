@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+test_fast_kernels.py
+====================
+
+fast_kernels 中加速内核与 OpenCV 参考实现的一致性测试：
+  - 融合尾段内核对照 GaussianBlur → Sobel（L1 幅值）→ 双阈值（不做非极大值抑制）
+    → 3×3 闭运算 → addWeighted 的 OpenCV 流程，边界均按复制方式处理；
+  - CLAHE 内核对照 cv2.createCLAHE()。
+两者均允许 1 个灰度级的舍入误差。运行方式：python -m unittest test_fast_kernels
+"""
+
+import unittest
+
+import cv2
+import numpy as np
+
+import fast_kernels
+
+_KERN3 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+def _test_frame(height, width, seed=0):
+    """
+    生成带平滑纹理与明显轮廓（矩形、圆）的测试灰度图，保证强、弱边缘都会出现。
+    """
+    rng = np.random.default_rng(seed)
+    gray = cv2.GaussianBlur(rng.integers(0, 256, (height, width), dtype=np.uint8), (0, 0), 2)
+    gray = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
+    cv2.rectangle(gray, (width // 4, height // 4), (width // 2, height // 2), 255, -1)
+    cv2.circle(gray, (3 * width // 4, height // 2), max(min(height, width) // 6, 1), 30, -1)
+    return gray
+
+def _reference_fused(equalized, t1, t2):
+    """
+    融合尾段的 OpenCV 参考实现：与内核相同，不做非极大值抑制，弱边缘只要 3×3 邻域内有强边缘即保留。
+    """
+    blurred = cv2.GaussianBlur(equalized, (5, 5), 0, borderType=cv2.BORDER_REPLICATE)
+    gx = cv2.Sobel(blurred, cv2.CV_16S, 1, 0, ksize=3, borderType=cv2.BORDER_REPLICATE)
+    gy = cv2.Sobel(blurred, cv2.CV_16S, 0, 1, ksize=3, borderType=cv2.BORDER_REPLICATE)
+    mag = np.abs(gx.astype(np.int32)) + np.abs(gy.astype(np.int32))
+    strong = (mag >= t2).astype(np.uint8)
+    near = cv2.dilate(strong, _KERN3)
+    edges = ((strong | ((mag >= t1) & (near > 0))) * 255).astype(np.uint8)
+    closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, _KERN3)
+    return cv2.addWeighted(equalized, 0.8, closed, 0.2, 0), closed
+
+def _max_diff(a, b):
+    return int(np.abs(a.astype(np.int32) - b.astype(np.int32)).max())
+
+@unittest.skipUnless(fast_kernels.KERNELS_AVAILABLE, "未安装 Numba，且没有预编译内核")
+class FusedTailTest(unittest.TestCase):
+    # 包含不能被行块高度整除的尺寸，以及单行、单列等退化情形
+    SIZES = [(480, 640), (67, 93), (5, 3), (1, 9), (33, 1)]
+    THRESHOLDS = [(50, 150), (30, 90), (200, 100)]
+
+    def test_matches_opencv(self):
+        for height, width in self.SIZES:
+            gray = _test_frame(height, width)
+            for t1, t2 in self.THRESHOLDS:
+                with self.subTest(size=(height, width), thresholds=(t1, t2)):
+                    expected, _ = _reference_fused(gray, t1, t2)
+                    self.assertLessEqual(_max_diff(fast_kernels.fused_tail(gray, t1=t1, t2=t2), expected), 1)
+
+    def test_reference_has_edges(self):
+        # 测试图须同时包含边缘与非边缘区域，否则一致性测试没有意义
+        _, closed = _reference_fused(_test_frame(480, 640), 50, 150)
+        self.assertTrue(0 < np.count_nonzero(closed) < closed.size // 2)
+
+    def test_specialised_matches_generic(self):
+        gray = _test_frame(67, 93)
+        preprocessor = fast_kernels.make_preprocessor(67, 93)
+        np.testing.assert_array_equal(preprocessor(gray), fast_kernels.fused_tail(gray))
+        with self.assertRaises(ValueError):
+            preprocessor(_test_frame(48, 64))
+
+    def test_rejects_mismatched_out(self):
+        gray = _test_frame(48, 64)
+        with self.assertRaises(ValueError):
+            fast_kernels.fused_tail(gray, out=np.empty((8, 8), np.uint8))
+        with self.assertRaises(ValueError):
+            fast_kernels.fused_tail(gray, out=np.empty((48, 64), np.int16))
+
+@unittest.skipUnless(fast_kernels.KERNELS_AVAILABLE, "未安装 Numba，且没有预编译内核")
+class ClaheTest(unittest.TestCase):
+    SIZES = [(480, 640), (240, 320), (48, 64)]
+
+    def test_matches_opencv(self):
+        for height, width in self.SIZES:
+            gray = _test_frame(height, width)
+            for clip_limit in (2.0, 4.0):
+                with self.subTest(size=(height, width), clip_limit=clip_limit):
+                    expected = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(8, 8)).apply(gray)
+                    self.assertLessEqual(_max_diff(fast_kernels.clahe_u8(gray, clip_limit=clip_limit), expected), 1)
+
+    def test_rejects_mismatched_out(self):
+        gray = _test_frame(48, 64)
+        with self.assertRaises(ValueError):
+            fast_kernels.clahe_u8(gray, out=np.empty((8, 8), np.uint8))
+
+if __name__ == '__main__':
+    unittest.main()